@@ -1,7 +1,15 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import streamlit as st
-from datetime import datetime
+import xlsxwriter
+from dataclasses import dataclass
+from functools import partial, reduce
+import hashlib
 import io
+import itertools
+import string
 
 st.set_page_config(
     page_title="Credit Card Statement Allocator", 
@@ -13,15 +21,39 @@ st.title("💳 Credit Card Statement Allocator")
 st.markdown("Allocate credit card transactions across multiple entities with built-in validation")
 
 # Define the 6 entities
-ENTITIES = [
+ENTITIES = (
     "Panola Holdings LLC",
     "Robert Dow (Personal)", 
     "RLV22 LLC",
     "CSD Van Zandt LLC",
     "Goodfire Realty LLC",
     "NDRE III LLC"
+)
+# Built once so column selections don't convert the labels on every call
+ENTITY_INDEX = pd.Index(ENTITIES)
+
+# pandas' default NA strings for read_csv; pyarrow's own list lacks "None" and "<NA>"
+CSV_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
 ]
 
+# Default number of allocation-table rows sent to the browser; a slider raises it
+PREVIEW_ROWS = 200
+
+@st.cache_resource
+def excel_column_letters(count):
+    """Excel column letters for columns 1..count (A..Z, AA..ZZ, AAA..)"""
+    letters = (
+        ''.join(combo)
+        for width in itertools.count(1)
+        for combo in itertools.product(string.ascii_uppercase, repeat=width)
+    )
+    return list(itertools.islice(letters, count))
+
+# Precomputed letters for every column Excel allows (A through XFD); EXCEL_COLS[n - 1] is column n
+EXCEL_COLS = excel_column_letters(16384)
+
 def detect_amount_column(df):
     """Detect the amount column from common variations"""
     possible_amount_columns = [
@@ -31,37 +63,95 @@ def detect_amount_column(df):
         'Purchase Amount', 'Charge Amount'
     ]
     
-    for col in possible_amount_columns:
-        if col in df.columns:
-            return col
-    
-    # Look for columns with numeric data that might be amounts
-    for col in df.columns:
-        if df[col].dtype in ['float64', 'int64'] or col.lower().find('amount') != -1:
-            return col
-    
-    return None
+    # Hash lookups against the header instead of scanning the Index for every candidate
+    available_columns = set(df.columns)
+    match = next((col for col in possible_amount_columns if col in available_columns), None)
+    if match is not None:
+        return match
+    
+    # Look for columns with numeric data that might be amounts, keeping header order
+    numeric_columns = set(df.select_dtypes(include='number').columns)
+    return next(
+        (col for col in df.columns if col in numeric_columns or 'amount' in col.lower()),
+        None
+    )
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_csv(file_bytes):
+    """Parse the uploaded CSV bytes with pyarrow, falling back to pandas"""
+    # pandas handles what pyarrow rejects: ragged rows, duplicate headers, non-UTF-8 text
+    try:
+        # Peek at the first block: keep date-like columns as text and all-empty columns
+        # as floats, matching what pandas' own parser produces
+        column_types = {}
+        peek_options = pacsv.ConvertOptions(null_values=CSV_NA_VALUES, strings_can_be_null=True)
+        for field in pacsv.open_csv(io.BytesIO(file_bytes), convert_options=peek_options).schema:
+            if pa.types.is_binary(field.type):
+                # Not valid UTF-8: let pandas raise its decode error
+                raise ValueError("Non-UTF-8 column")
+            if pa.types.is_temporal(field.type):
+                column_types[field.name] = pa.string()
+            elif pa.types.is_null(field.type):
+                column_types[field.name] = pa.float64()
+        
+        table = pacsv.read_csv(
+            io.BytesIO(file_bytes),
+            convert_options=pacsv.ConvertOptions(
+                column_types=column_types, null_values=CSV_NA_VALUES, strings_can_be_null=True
+            )
+        )
+        if len(set(table.column_names)) != table.num_columns:
+            raise ValueError("Duplicate column names")
+        df = table.to_pandas()
+        # Blank header cells get pandas' "Unnamed: N" names
+        df.columns = [name or f"Unnamed: {i}" for i, name in enumerate(df.columns)]
+        return df
+    except ValueError:  # pa.ArrowInvalid is a ValueError
+        return pd.read_csv(io.BytesIO(file_bytes))
 
-def process_credit_card_data(df, amount_column):
-    """Process the credit card data and add allocation columns"""
+def numeric_or_zero(series):
+    """Coerce a column to numbers with blanks and non-numeric values as 0"""
+    # Columns the parser already typed skip the coercion and are only copied if they have blanks
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return series.fillna(0) if series.hasnans else series
+    return pd.to_numeric(series, errors='coerce').fillna(0)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def process_credit_card_data(_df, amount_column, file_digest):
+    """Process the credit card data and add allocation columns, returning it with its metrics"""
     
-    # Create a copy to avoid modifying the original
-    processed_df = df.copy()
+    # Shallow copy: columns are only ever replaced or added, never written into, so the
+    # original frame is left untouched without duplicating its data
+    processed_df = _df.copy(deep=False)
     
     # Ensure the amount column is numeric
     try:
-        processed_df[amount_column] = pd.to_numeric(processed_df[amount_column], errors='coerce')
-        processed_df[amount_column] = processed_df[amount_column].fillna(0)
+        processed_df[amount_column] = numeric_or_zero(processed_df[amount_column])
     except:
         st.warning(f"Could not convert {amount_column} to numeric. Using values as-is.")
-    
-    # Add allocation columns for each entity (initialized to 0)
-    for entity in ENTITIES:
-        processed_df[entity] = 0.0
+    total_amount = processed_df[amount_column].sum()
+    
+    # Allocations live in one (rows x entities) matrix, column-major so each entity is contiguous
+    # and sums exactly as its column would; the summary reductions run on it directly.
+    # Entity columns the upload already has (e.g. a re-uploaded export) are zeroed where they
+    # sit so the F..K layout is kept; the missing ones are appended together as one block
+    allocations = np.zeros((len(processed_df), len(ENTITIES)), order='F')
+    missing = []
+    for pos, entity in enumerate(ENTITIES):
+        if entity in processed_df.columns:
+            processed_df[entity] = 0.0
+        else:
+            missing.append(pos)
+    if missing:
+        entity_block = pd.DataFrame(allocations[:, missing], index=processed_df.index, columns=ENTITY_INDEX[missing])
+        processed_df = pd.concat([processed_df, entity_block], axis=1)
     
     # Get column positions to understand D and E
     columns = processed_df.columns.tolist()
     
+    # Set once D and E are numeric, so the check below reuses them instead of coercing again
+    de_columns = None
+    
     # Check if we have at least 6 columns (A, B, C, D, E, F...)
     if len(columns) >= 6:
         col_d = columns[3]  # 4th column (index 3) = Column D
@@ -69,13 +159,14 @@ def process_credit_card_data(df, amount_column):
         
         # Try to make D and E numeric
         try:
-            processed_df[col_d] = pd.to_numeric(processed_df[col_d], errors='coerce').fillna(0)
-            processed_df[col_e] = pd.to_numeric(processed_df[col_e], errors='coerce').fillna(0)
+            processed_df[col_d] = numeric_or_zero(processed_df[col_d])
+            processed_df[col_e] = numeric_or_zero(processed_df[col_e])
             
             # DEFAULT ALLOCATION: Panola Holdings LLC = sum of columns D and E
             processed_df['Panola Holdings LLC'] = processed_df[col_d] + processed_df[col_e]
             
             st.info(f"✅ Default allocation: Panola Holdings LLC = {col_d} + {col_e}")
+            de_columns = (col_d, col_e)
             
         except:
             # Fallback to amount column if D and E aren't numeric
@@ -86,100 +177,145 @@ def process_credit_card_data(df, amount_column):
         processed_df['Panola Holdings LLC'] = processed_df[amount_column]
         st.warning(f"⚠️ Not enough columns for D+E logic, defaulting to {amount_column}")
     
-    # Add validation columns - but we'll replace these with Excel formulas
-    processed_df['Total_Allocated'] = processed_df[ENTITIES].sum(axis=1)
-    
-    # For allocation check, we need to compare against D+E sum, not original amount column
-    if len(columns) >= 6:
-        col_d = columns[3]  # Column D
-        col_e = columns[4]  # Column E
-        try:
-            d_values = pd.to_numeric(processed_df[col_d], errors='coerce').fillna(0)
-            e_values = pd.to_numeric(processed_df[col_e], errors='coerce').fillna(0)
-            processed_df['Allocation_Check'] = (d_values + e_values) - processed_df['Total_Allocated']
-        except:
-            processed_df['Allocation_Check'] = processed_df[amount_column] - processed_df['Total_Allocated']
+    # Only Panola is allocated by default; the other entities stay zero
+    allocations[:, 0] = processed_df['Panola Holdings LLC'].to_numpy()
+    
+    # Add validation columns - but we'll replace these with Excel formulas.
+    # Only Panola is allocated by default, so its column already is the row total.
+    processed_df['Total_Allocated'] = allocations[:, 0].copy()
+    
+    # For allocation check, we need to compare against D+E sum, not original amount column.
+    # Panola was just set to exactly that sum (or to the amount column on fallback), so the
+    # check is only non-zero when D or E is itself an entity column (CSVs with < 5 columns).
+    check = None
+    de_totals = None
+    if de_columns is not None:
+        # Read D and E as they stand now - either may be an entity column Panola was just written to
+        col_d, col_e = de_columns
+        d_values = processed_df[col_d]
+        e_values = processed_df[col_e]
+        if col_d in ENTITIES or col_e in ENTITIES:
+            check = (d_values + e_values) - processed_df['Total_Allocated']
+        de_totals = (col_d, col_e, d_values.sum(), e_values.sum())
+        total_transactions = de_totals[2] + de_totals[3]
     else:
-        processed_df['Allocation_Check'] = processed_df[amount_column] - processed_df['Total_Allocated']
-    
-    processed_df['Allocation_Status'] = processed_df['Allocation_Check'].apply(
-        lambda x: 'Balanced' if abs(x) < 0.01 else f'Off by ${x:.2f}'
-    )
+        total_transactions = total_amount
+    
+    if check is None:
+        # Balanced by construction: constant columns instead of a subtract and a format pass
+        processed_df['Allocation_Check'] = 0.0
+        processed_df['Allocation_Status'] = pd.Categorical.from_codes(
+            np.zeros(len(processed_df), dtype=np.int8), ['Balanced']
+        )
+        unbalanced_mask = np.zeros(len(processed_df), dtype=bool)
+    else:
+        processed_df['Allocation_Check'] = check
+        check = check.to_numpy()
+        abs_check = np.abs(check)
+        # Stored as a category: most rows share 'Balanced', so each row only carries a code.
+        # The 'Off by $' text is formatted once per distinct off amount, not once per row; amounts
+        # that round to the same cents share one label
+        off_rows = ~(abs_check < 0.01)
+        off_values, value_codes = np.unique(check[off_rows], return_inverse=True)
+        off_labels, label_codes = np.unique(
+            np.char.add('Off by $', np.char.mod('%.2f', off_values)), return_inverse=True
+        )
+        status_codes = np.zeros(len(check), dtype=np.int32)
+        status_codes[off_rows] = label_codes.ravel()[value_codes.ravel()] + 1
+        processed_df['Allocation_Status'] = pd.Categorical.from_codes(
+            status_codes, ['Balanced', *off_labels.tolist()]
+        )
+        unbalanced_mask = abs_check >= 0.01
     
     # Add Property column at the end
     processed_df['Property'] = ''
     
-    return processed_df
+    # Merchant names repeat heavily: store each distinct description once, so the preview ships
+    # it dictionary-encoded and the workbook writer reuses one string object per merchant
+    description = processed_df.get('Description')
+    if description is not None and pd.api.types.infer_dtype(description, skipna=True) == 'string':
+        codes, uniques = pd.factorize(description)
+        if len(uniques) <= len(description) // 2:
+            processed_df['Description'] = pd.Categorical.from_codes(codes, uniques)
+    
+    # Summary metrics from the arrays already in hand, in a single pass each
+    entity_sums = allocations.sum(axis=0)
+    metrics = {
+        'entity_totals': dict(zip(ENTITIES, entity_sums)),
+        'entity_counts': dict(zip(ENTITIES, np.count_nonzero(allocations, axis=0))),
+        'total_amount': total_amount,
+        'total_transactions': total_transactions,
+        'de_totals': de_totals,
+        'total_allocated': entity_sums.sum(),
+        'unbalanced_mask': unbalanced_mask,
+    }
+    # Content fingerprint keying the display and download caches; taken here so it is
+    # computed once per processed frame rather than on every rerun
+    metrics['fingerprint'] = dataframe_fingerprint(processed_df)
+    
+    return processed_df, metrics
+
+@st.cache_resource(max_entries=64)
+def column_letters(columns):
+    """Map each column name in a header tuple to its Excel letter"""
+    # Shared between callers through the cache - do not mutate. The first occurrence of a name wins
+    letters = {}
+    for letter, col in zip(EXCEL_COLS, columns):
+        letters.setdefault(col, letter)
+    return letters
 
 def create_excel_with_formulas(df, amount_column):
-    """Create CSV content with Excel formula placeholders for the check column and totals"""
+    """Create Excel formulas for the check columns and the totals row"""
     
-    # Find the column positions (Excel uses 1-based indexing)
+    # Excel letters for every column, memoized per header layout
     columns = df.columns.tolist()
-    amount_col_idx = columns.index(amount_column) + 1  # Excel column number
+    col_letters = column_letters(tuple(columns))
     
-    # Find entity column positions
-    entity_col_positions = {}
-    for entity in ENTITIES:
-        if entity in columns:
-            entity_col_positions[entity] = columns.index(entity) + 1
-    
-    total_allocated_col_idx = columns.index('Total_Allocated') + 1
-    allocation_check_col_idx = columns.index('Allocation_Check') + 1
-    property_col_idx = columns.index('Property') + 1
-    rlv22_col_idx = columns.index('RLV22 LLC') + 1
-    
-    # Convert to Excel column letters
-    def num_to_excel_col(n):
-        result = ""
-        while n > 0:
-            n -= 1
-            result = chr(n % 26 + ord('A')) + result
-            n //= 26
-        return result
-    
-    amount_col_letter = num_to_excel_col(amount_col_idx)
-    total_allocated_col_letter = num_to_excel_col(total_allocated_col_idx)
-    allocation_check_col_letter = num_to_excel_col(allocation_check_col_idx)
-    property_col_letter = num_to_excel_col(property_col_idx)
-    rlv22_col_letter = num_to_excel_col(rlv22_col_idx)
+    amount_col_letter = col_letters[amount_column]
+    total_allocated_col_letter = col_letters['Total_Allocated']
+    allocation_check_col_letter = col_letters['Allocation_Check']
+    property_col_letter = col_letters['Property']
+    rlv22_col_letter = col_letters['RLV22 LLC']
     
     # Entity column letters
-    entity_col_letters = {}
-    for entity, pos in entity_col_positions.items():
-        entity_col_letters[entity] = num_to_excel_col(pos)
-    
-    # Create the enhanced DataFrame
-    enhanced_df = df.copy()
+    entity_col_letters = {entity: col_letters[entity] for entity in ENTITIES if entity in col_letters}
     
     # Replace the static calculations with formula placeholders
     num_rows = len(df)
     
     # Total_Allocated formulas (sum of entity columns for each row)
-    entity_range_start = num_to_excel_col(entity_col_positions[ENTITIES[0]])
-    entity_range_end = num_to_excel_col(entity_col_positions[ENTITIES[-1]])
+    entity_range_start = entity_col_letters[ENTITIES[0]]
+    entity_range_end = entity_col_letters[ENTITIES[-1]]
+    
+    # Build every formula column in one pass - Excel rows start at 1, plus header row.
+    # Row numbers use the narrowest fixed-width string dtype so the char ops move fewer bytes.
+    rows = np.arange(2, num_rows + 2).astype(f'U{len(str(num_rows + 1))}')
+    
+    def concat(*parts):
+        """Element-wise string concatenation of literals and the row number array"""
+        return reduce(np.char.add, parts)
     
-    for i in range(num_rows):
-        row_num = i + 2  # Excel rows start at 1, plus header row
+    formula_columns = {
         # Total_Allocated formula: sum of all entity columns
-        enhanced_df.iloc[i, enhanced_df.columns.get_loc('Total_Allocated')] = f"=SUM({entity_range_start}{row_num}:{entity_range_end}{row_num})"
+        'Total_Allocated': concat(f"=SUM({entity_range_start}", rows, f":{entity_range_end}", rows, ")"),
         # Allocation_Check formula: (Debit + Credit) - Total_Allocated
-        enhanced_df.iloc[i, enhanced_df.columns.get_loc('Allocation_Check')] = f"=(D{row_num}+E{row_num})-{total_allocated_col_letter}{row_num}"
+        'Allocation_Check': concat("=(D", rows, "+E", rows, f")-{total_allocated_col_letter}", rows),
         # Status formula: IF check is nearly zero, show balanced, else show difference (NO EMOJIS)
-        enhanced_df.iloc[i, enhanced_df.columns.get_loc('Allocation_Status')] = f'=IF(ABS({allocation_check_col_letter}{row_num})<0.01,"Balanced","Off by $"&ROUND({allocation_check_col_letter}{row_num},2))'
+        'Allocation_Status': concat(f'=IF(ABS({allocation_check_col_letter}', rows, f')<0.01,"Balanced","Off by $"&ROUND({allocation_check_col_letter}', rows, ',2))'),
         # Property formula: IF RLV22 LLC has a value, show "Required", else blank
-        enhanced_df.iloc[i, enhanced_df.columns.get_loc('Property')] = f'=IF({rlv22_col_letter}{row_num}<>0,"Required","")'
+        'Property': concat(f'=IF({rlv22_col_letter}', rows, '<>0,"Required","")'),
+    }
     
     # Add totals row
     totals_row_num = num_rows + 2  # After data rows
     totals_row = {}
     
     # Initialize totals row
-    for col in enhanced_df.columns:
+    for col in columns:
         totals_row[col] = ""
     
     # First column gets "TOTALS" label
-    first_col = enhanced_df.columns[0]
+    first_col = columns[0]
     totals_row[first_col] = "TOTALS"
     
     # Amount column total
@@ -190,7 +326,7 @@ def create_excel_with_formulas(df, amount_column):
     
     # Entity column totals
     for entity in ENTITIES:
-        if entity in enhanced_df.columns:
+        if entity in entity_col_letters:
             col_letter = entity_col_letters[entity]
             totals_row[entity] = f"=SUM({col_letter}2:{col_letter}{num_rows + 1})"
     
@@ -206,57 +342,191 @@ def create_excel_with_formulas(df, amount_column):
     # Property totals - count how many are "Required"
     totals_row['Property'] = f'=COUNTIF({property_col_letter}2:{property_col_letter}{num_rows + 1},"Required")&" Required"'
     
-    # Append totals row
-    enhanced_df = pd.concat([enhanced_df, pd.DataFrame([totals_row])], ignore_index=True)
-    
-    return enhanced_df
+    return formula_columns, totals_row
 
-def validate_allocations(df, amount_column):
-    """Validate that all transactions are properly allocated"""
-    
-    validation_results = {}
+@dataclass(frozen=True)
+class Validation:
+    """Allocation checks shown in the validation summary and the sidebar"""
+    unbalanced_count: int
+    total_unallocated: float
+    entity_totals: dict
+    total_amount: float
+    total_transactions: float
+    total_allocated: float
+    grand_total_check: float
+
+def validate_allocations(df, metrics):
+    """Validate that all transactions are properly allocated, using the metrics from processing"""
     
     # Check for unallocated amounts
-    unbalanced = df[abs(df['Allocation_Check']) >= 0.01]
-    validation_results['unbalanced_count'] = len(unbalanced)
-    validation_results['total_unallocated'] = unbalanced['Allocation_Check'].sum()
-    
-    # Entity totals
-    entity_totals = {}
-    for entity in ENTITIES:
-        entity_totals[entity] = df[entity].sum()
-    validation_results['entity_totals'] = entity_totals
-    
-    # Overall totals - use D+E sum instead of amount column for proper validation
+    unbalanced_mask = metrics['unbalanced_mask']
+    
+    # Overall totals - D+E sum (or the amount column fallback) recorded during processing
+    return Validation(
+        unbalanced_count=int(np.count_nonzero(unbalanced_mask)),
+        total_unallocated=df['Allocation_Check'].to_numpy()[unbalanced_mask].sum(),
+        entity_totals=metrics['entity_totals'],
+        total_amount=metrics['total_amount'],
+        total_transactions=metrics['total_transactions'],
+        total_allocated=metrics['total_allocated'],
+        grand_total_check=metrics['total_transactions'] - metrics['total_allocated']
+    )
+
+def dataframe_fingerprint(df):
+    """Content hash of a DataFrame, used as a cache key in place of the frame itself"""
+    # Row hashes are digested in order with the header, so reordered rows or renamed columns differ
+    digest = hashlib.blake2b(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes(), digest_size=16)
+    digest.update(repr(df.columns.tolist()).encode())
+    return digest.hexdigest()
+
+def iter_excel_rows(df, formula_columns, totals_row):
+    """Yield the header, each data row with its formulas spliced in, then the totals row"""
     columns = df.columns.tolist()
-    if len(columns) >= 6:
-        col_d = columns[3]  # Column D
-        col_e = columns[4]  # Column E
+    yield columns
+    
+    # tolist() turns each numpy string array into Python str objects in one C-level pass
+    formula_positions = [columns.index(col) for col in formula_columns]
+    formula_lists = [formulas.tolist() for formulas in formula_columns.values()]
+    for row, *formulas in zip(df.itertuples(index=False, name=None), *formula_lists):
+        values = [None if pd.isna(value) else value for value in row]
+        for pos, formula in zip(formula_positions, formulas):
+            values[pos] = formula
+        yield values
+    
+    yield [totals_row[col] for col in columns]
+
+def object_columns_as_text(df):
+    """Cast object columns to str so mixed-type columns convert to Arrow, as st.dataframe itself would"""
+    object_columns = df.select_dtypes(include='object').columns
+    return df.astype({col: str for col in object_columns})
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def to_arrow_table(_processed_df, amount_column, cache_key):
+    """Build the Arrow table for the allocation display, keyed on the frame fingerprint"""
+    # Reorder columns - amount column first, then entities, then validation, then Property at the end
+    amount_and_entity_columns = [amount_column, *ENTITIES, 'Total_Allocated', 'Allocation_Check', 'Allocation_Status', 'Property']
+    other_columns = [col for col in _processed_df.columns if col not in amount_and_entity_columns]
+    display_df = _processed_df[other_columns + amount_and_entity_columns]
+    try:
+        # The index is kept so filtered views show original row numbers
+        return pa.Table.from_pandas(display_df, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.Table.from_pandas(object_columns_as_text(display_df), preserve_index=True)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_excel_file(_processed_df, amount_column, cache_key):
+    """Write the allocations with formulas and totals to a formatted Excel workbook and return its bytes"""
+    processed_df = _processed_df
+    formula_columns, totals_row = create_excel_with_formulas(processed_df, amount_column)
+    
+    # constant_memory flushes each row once the next starts, so rows go in order; in_memory would override it
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'strings_to_urls': False,
+        'nan_inf_to_errors': True,
+    })
+    worksheet = workbook.add_worksheet('Allocations')
+    
+    # Set fixed column widths for better appearance
+    column_widths = {
+        'A': 12,   # Status
+        'B': 15,   # Date  
+        'C': 35,   # Description
+        'D': 12,   # Debit
+        'E': 12,   # Credit
+        'F': 18,   # Panola Holdings LLC
+        'G': 18,   # Robert Dow (Personal)
+        'H': 12,   # RLV22 LLC
+        'I': 18,   # CSD Van Zandt LLC
+        'J': 18,   # Goodfire Realty LLC
+        'K': 12,   # NDRE III LLC
+        'L': 15,   # Total_Allocated
+        'M': 10,   # Allocation_Check (narrower)
+        'N': 10,   # Allocation_Status (narrower)
+        'O': 12    # Property
+    }
+    for col_letter, width in column_widths.items():
+        worksheet.set_column(f'{col_letter}:{col_letter}', width)
+    
+    # Set header row height to accommodate wrapped text (before the row is written)
+    worksheet.set_row(0, 30)
+    
+    # Header cells: bold with thin borders plus centered, wrapped text
+    header_format = workbook.add_format({
+        'bold': True, 'border': 1, 'text_wrap': True, 'align': 'center', 'valign': 'vcenter'
+    })
+    
+    # Apply currency formatting to columns D through M (columns 4-13, zero-based 3-12)
+    currency_format = workbook.add_format({'num_format': '$#,##0.00'})
+    currency_cols = range(3, 13)
+    
+    # Strings starting with "=" are written as live formulas
+    rows = iter_excel_rows(processed_df, formula_columns, totals_row)
+    worksheet.write_row(0, 0, next(rows), header_format)
+    for row_num, values in enumerate(rows, 1):
+        for col_num, value in enumerate(values):
+            if col_num in currency_cols:
+                worksheet.write(row_num, col_num, value, currency_format)
+            elif value is not None:
+                worksheet.write(row_num, col_num, value)
+    
+    # Add conditional formatting for Allocation_Status and Property columns
+    red_format = workbook.add_format({'bg_color': '#FFCCCC', 'font_color': '#CC0000'})  # Light red background, dark red text
+    
+    # Find Allocation_Status and Property column positions
+    col_letters = column_letters(tuple(processed_df.columns))
+    allocation_status_col = col_letters.get('Allocation_Status')
+    property_col = col_letters.get('Property')
+    
+    # Apply conditional formatting to data rows (skip header and totals)
+    data_rows = len(processed_df)  # Totals row is not part of the frame
+    
+    # Conditional formatting for Allocation_Status: Red if not "Balanced"
+    if allocation_status_col:
+        worksheet.conditional_format(f'{allocation_status_col}2:{allocation_status_col}{data_rows}', {
+            'type': 'cell', 'criteria': 'not equal to', 'value': '"Balanced"', 'format': red_format
+        })
+    
+    # Conditional formatting for Property: Red if "Required"
+    if property_col:
+        worksheet.conditional_format(f'{property_col}2:{property_col}{data_rows}', {
+            'type': 'cell', 'criteria': 'equal to', 'value': '"Required"', 'format': red_format
+        })
+    
+    workbook.close()
+    
+    return output.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_flat_file(_processed_df, file_format, cache_key):
+    """Write the allocations as plain values to CSV or Parquet and return the bytes"""
+    output = io.BytesIO()
+    if file_format == 'Parquet':
         try:
-            d_total = pd.to_numeric(df[col_d], errors='coerce').fillna(0).sum()
-            e_total = pd.to_numeric(df[col_e], errors='coerce').fillna(0).sum()
-            validation_results['total_transactions'] = d_total + e_total
-        except:
-            validation_results['total_transactions'] = df[amount_column].sum()
+            _processed_df.to_parquet(output, engine='pyarrow', compression='zstd', index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            output = io.BytesIO()
+            object_columns_as_text(_processed_df).to_parquet(output, engine='pyarrow', compression='zstd', index=False)
     else:
-        validation_results['total_transactions'] = df[amount_column].sum()
-    
-    validation_results['total_allocated'] = df['Total_Allocated'].sum()
-    validation_results['grand_total_check'] = validation_results['total_transactions'] - validation_results['total_allocated']
-    
-    return validation_results
+        _processed_df.to_csv(output, index=False)
+    return output.getvalue()
 
 # File upload
 uploaded_file = st.file_uploader("Upload your credit card statement CSV", type=['csv'])
 
 if uploaded_file is not None:
+    # Kept outside the try so the debugging output can reuse the parsed frame
+    df = None
     try:
-        # Read the CSV file
-        df = pd.read_csv(uploaded_file)
+        # Read the CSV file - the spinner only appears if the parse takes noticeable time
+        with st.spinner("Reading statement..."):
+            file_bytes = uploaded_file.getvalue()
+            df = load_csv(file_bytes)
         
         st.subheader("📊 Original Data Preview")
         st.write(f"**Loaded:** {len(df):,} transactions")
-        st.dataframe(df.head(10), use_container_width=True)
+        st.dataframe(df.head(10), width="stretch")
         
         # Show column mapping
         columns = df.columns.tolist()
@@ -286,13 +556,20 @@ if uploaded_file is not None:
         if amount_column:
             # Process the data
             with st.spinner("Processing allocations..."):
-                processed_df = process_credit_card_data(df, amount_column)
+                # Keyed on the upload bytes: Streamlit's frame hash only samples large frames
+                file_digest = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+                processed_df, metrics = process_credit_card_data(df, amount_column, file_digest)
+                # Content fingerprint used to key the display and download caches
+                processed_key = metrics['fingerprint']
             
             st.success("✅ Processing complete! Default allocation: Panola Holdings LLC = Column D + Column E")
             
             # Display processed data
             st.subheader("💰 Allocation Results")
             
+            # Validation results - computed up front so the metric row reads its totals
+            validation = validate_allocations(processed_df, metrics)
+            
             # Summary metrics
             col1, col2, col3, col4 = st.columns(4)
             
@@ -300,11 +577,11 @@ if uploaded_file is not None:
                 st.metric("Total Transactions", f"{len(processed_df):,}")
             
             with col2:
-                total_amount = processed_df[amount_column].sum()
+                total_amount = validation.total_amount
                 st.metric("Total Amount", f"${total_amount:,.2f}")
             
             with col3:
-                total_allocated = processed_df['Total_Allocated'].sum()
+                total_allocated = validation.total_allocated
                 st.metric("Total Allocated", f"${total_allocated:,.2f}")
             
             with col4:
@@ -312,78 +589,85 @@ if uploaded_file is not None:
                 st.metric("Allocation Check", f"${allocation_difference:,.2f}", 
                          delta_color="inverse" if abs(allocation_difference) > 0.01 else "normal")
             
-            # Show D+E breakdown if applicable
-            columns = processed_df.columns.tolist()
-            if len(columns) >= 6:
-                col_d = columns[3]  # Column D
-                col_e = columns[4]  # Column E
+            # Show D+E breakdown if applicable - the totals were taken during processing
+            if metrics['de_totals'] is not None:
+                col_d, col_e, d_total, e_total = metrics['de_totals']
                 
-                # Check if D and E are numeric
-                try:
-                    d_total = pd.to_numeric(processed_df[col_d], errors='coerce').sum()
-                    e_total = pd.to_numeric(processed_df[col_e], errors='coerce').sum()
-                    
-                    with st.expander("📊 Column D + E Breakdown"):
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.write(f"**{col_d} Total:** ${d_total:,.2f}")
-                        with col2:
-                            st.write(f"**{col_e} Total:** ${e_total:,.2f}")
-                        with col3:
-                            st.write(f"**D+E Total:** ${d_total + e_total:,.2f}")
-                except:
-                    st.info("ℹ️ Columns D and E are not numeric - using amount column fallback")
+                with st.expander("📊 Column D + E Breakdown"):
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.write(f"**{col_d} Total:** ${d_total:,.2f}")
+                    with col2:
+                        st.write(f"**{col_e} Total:** ${e_total:,.2f}")
+                    with col3:
+                        st.write(f"**D+E Total:** ${d_total + e_total:,.2f}")
+            else:
+                st.info("ℹ️ Columns D and E are not numeric - using amount column fallback")
             
             # Entity breakdown
             st.subheader("🏢 Entity Allocation Summary")
-            entity_summary = []
-            for entity in ENTITIES:
-                entity_total = processed_df[entity].sum()
-                entity_percentage = (entity_total / total_amount * 100) if total_amount != 0 else 0
-                entity_summary.append({
-                    'Entity': entity,
-                    'Total Allocated': f"${entity_total:,.2f}",
-                    'Percentage': f"{entity_percentage:.1f}%",
-                    'Transaction Count': (processed_df[entity] != 0).sum()
-                })
+            entity_totals = np.fromiter(metrics['entity_totals'].values(), dtype=float, count=len(ENTITIES))
+            if total_amount != 0:
+                entity_percentages = entity_totals / total_amount * 100
+            else:
+                entity_percentages = np.zeros(len(ENTITIES))
+            # Numeric columns stay numeric so they sort; the Styler formats only these six rows
+            entity_summary = pd.DataFrame({
+                'Entity': ENTITIES,
+                'Total Allocated': entity_totals,
+                'Percentage': entity_percentages,
+                'Transaction Count': list(metrics['entity_counts'].values())
+            })
             
-            st.dataframe(pd.DataFrame(entity_summary), use_container_width=True)
+            st.dataframe(
+                entity_summary.style.format({'Total Allocated': '${:,.2f}', 'Percentage': '{:.1f}%'}),
+                width="stretch"
+            )
             
             # Display full allocation table
             st.subheader("📋 Full Allocation Table")
             
-            # Reorder columns for better display - put amount column first, then entities, then validation, then Property at the end
-            amount_and_entity_columns = [amount_column] + ENTITIES + ['Total_Allocated', 'Allocation_Check', 'Allocation_Status', 'Property']
-            other_columns = [col for col in processed_df.columns if col not in amount_and_entity_columns]
-            display_columns = other_columns + amount_and_entity_columns
+            # Reordered for display and converted to Arrow once, then shared by both tables
+            display_table = to_arrow_table(processed_df, amount_column, processed_key)
+            # Currency is formatted by the browser grid, so no per-cell strings are built here
+            currency_config = {
+                col: st.column_config.NumberColumn(format="dollar")
+                for col in [amount_column, *ENTITIES, 'Total_Allocated', 'Allocation_Check']
+            }
+            # Only the previewed rows are sent to the browser; the fixed height keeps the grid scrolling
+            preview_rows = display_table.num_rows
+            if preview_rows > PREVIEW_ROWS:
+                preview_rows = st.slider("Rows to preview", PREVIEW_ROWS, display_table.num_rows, PREVIEW_ROWS)
+                st.caption(f"Showing the first {preview_rows:,} of {display_table.num_rows:,} transactions - every row is in the download")
+            st.dataframe(display_table.slice(0, preview_rows), width="stretch", height=400,
+                         column_config=currency_config)
             
-            st.dataframe(processed_df[display_columns], use_container_width=True)
-            
-            # Show unbalanced transactions if any
-            unbalanced = processed_df[abs(processed_df['Allocation_Check']) >= 0.01]
-            if len(unbalanced) > 0:
+            # Show unbalanced transactions if any - rows are only copied when the mask has a hit
+            unbalanced_mask = metrics['unbalanced_mask']
+            if unbalanced_mask.any():
                 st.subheader("⚠️ Unbalanced Transactions")
-                st.dataframe(unbalanced[display_columns], use_container_width=True)
-            
-            # Validation results
-            validation = validate_allocations(processed_df, amount_column)
+                st.dataframe(display_table.filter(unbalanced_mask), width="stretch",
+                             column_config=currency_config)
             
             st.subheader("✅ Validation Summary")
             
             col1, col2 = st.columns(2)
             
             with col1:
-                if validation['unbalanced_count'] == 0:
+                if validation.unbalanced_count == 0:
                     st.success(f"🎉 All {len(processed_df):,} transactions are properly allocated!")
                 else:
-                    st.warning(f"⚠️ {validation['unbalanced_count']} transactions need allocation review")
+                    st.warning(f"⚠️ {validation.unbalanced_count} transactions need allocation review")
                 
-                st.metric("Grand Total Check", f"${validation['grand_total_check']:.2f}")
+                st.metric("Grand Total Check", f"${validation.grand_total_check:.2f}")
             
             with col2:
-                st.write("**Entity Totals:**")
-                for entity, total in validation['entity_totals'].items():
-                    st.write(f"• {entity}: ${total:,.2f}")
+                # One markdown block instead of a message per entity; hard line breaks keep one
+                # entity per line, and the dollar signs are escaped so pairs don't render as math
+                st.markdown("  \n".join(
+                    ["**Entity Totals:**"]
+                    + [f"• {entity}: \\${total:,.2f}" for entity, total in validation.entity_totals.items()]
+                ))
             
             # Download section
             st.subheader("📥 Download Processed Files")
@@ -392,133 +676,38 @@ if uploaded_file is not None:
             original_filename = uploaded_file.name
             if original_filename.endswith('.csv'):
                 base_name = original_filename[:-4]  # Remove .csv extension
-                enhanced_filename = f"{base_name}_allocated.xlsx"
             else:
-                enhanced_filename = f"{original_filename}_allocated.xlsx"
+                base_name = original_filename
             
-            # Create enhanced version with formulas and totals
-            with st.spinner("Creating Excel-ready file with formulas..."):
-                enhanced_df = create_excel_with_formulas(processed_df, amount_column)
+            download_format = st.radio("Download as", ["Excel", "CSV", "Parquet"], horizontal=True)
             
-            # Main allocation Excel file with formulas - single download option
-            st.write("**📊 Enhanced Allocation File (Excel with formulas & totals):**")
-            
-            # Create Excel file in memory with formatting
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                enhanced_df.to_excel(writer, sheet_name='Allocations', index=False)
-                
-                # Get the workbook and worksheet to add formatting
-                workbook = writer.book
-                worksheet = writer.sheets['Allocations']
-                
-                # Import openpyxl formatting
-                from openpyxl.styles import NamedStyle, Alignment, PatternFill, Font
-                from openpyxl.utils import get_column_letter
-                
-                # Create currency style
-                currency_style = NamedStyle(name="currency", number_format='$#,##0.00')
+            # Files are built only when the button is clicked, off the script thread, so widget
+            # reruns never pay for them. partial() binds this run's frame and key, so a click
+            # always downloads the data on screen
+            if download_format == "Excel":
+                # Main allocation Excel file with formulas
+                st.write("**📊 Enhanced Allocation File (Excel with formulas & totals):**")
                 
-                # Apply currency formatting to columns D through M (columns 4-13)
-                num_rows = len(enhanced_df) + 1  # +1 for header
-                
-                for col_num in range(4, 14):  # Columns D(4) through M(13)
-                    col_letter = get_column_letter(col_num)
-                    for row_num in range(2, num_rows + 1):  # Skip header row
-                        cell = worksheet[f'{col_letter}{row_num}']
-                        cell.number_format = '$#,##0.00'
-                
-                # Set fixed column widths for better appearance
-                column_widths = {
-                    'A': 12,   # Status
-                    'B': 15,   # Date  
-                    'C': 35,   # Description
-                    'D': 12,   # Debit
-                    'E': 12,   # Credit
-                    'F': 18,   # Panola Holdings LLC
-                    'G': 18,   # Robert Dow (Personal)
-                    'H': 12,   # RLV22 LLC
-                    'I': 18,   # CSD Van Zandt LLC
-                    'J': 18,   # Goodfire Realty LLC
-                    'K': 12,   # NDRE III LLC
-                    'L': 15,   # Total_Allocated
-                    'M': 10,   # Allocation_Check (narrower)
-                    'N': 10,   # Allocation_Status (narrower)
-                    'O': 12    # Property
-                }
-                
-                # Apply fixed widths
-                for col_letter, width in column_widths.items():
-                    worksheet.column_dimensions[col_letter].width = width
-                
-                # Add text wrapping to header row
-                for col_num in range(1, len(enhanced_df.columns) + 1):
-                    col_letter = get_column_letter(col_num)
-                    header_cell = worksheet[f'{col_letter}1']
-                    header_cell.alignment = Alignment(wrap_text=True, horizontal='center', vertical='center')
-                
-                # Set header row height to accommodate wrapped text
-                worksheet.row_dimensions[1].height = 30
-                
-                # Add conditional formatting for Allocation_Status and Property columns
-                red_fill = PatternFill(start_color='FFCCCC', end_color='FFCCCC', fill_type='solid')  # Light red background
-                red_font = Font(color='CC0000')  # Dark red text
-                
-                # Find Allocation_Status and Property column positions
-                allocation_status_col = None
-                property_col = None
-                
-                for col_num, col_name in enumerate(enhanced_df.columns, 1):
-                    if col_name == 'Allocation_Status':
-                        allocation_status_col = get_column_letter(col_num)
-                    elif col_name == 'Property':
-                        property_col = get_column_letter(col_num)
-                
-                # Apply conditional formatting to data rows (skip header and totals)
-                data_rows = len(enhanced_df) - 1  # Subtract 1 for totals row
-                
-                # Format Allocation_Status column: Red if not "Balanced"
-                if allocation_status_col:
-                    for row_num in range(2, data_rows + 1):  # Skip header row
-                        cell = worksheet[f'{allocation_status_col}{row_num}']
-                        # Check if cell contains formula that would result in "Off by"
-                        if hasattr(cell, 'value') and cell.value and isinstance(cell.value, str):
-                            if 'IF(' in str(cell.value):  # It's a formula
-                                # Apply conditional formatting based on the formula result
-                                # We'll format cells that don't show "Balanced"
-                                pass  # Excel conditional formatting will handle this
-                        # For now, we'll check the actual computed values after Excel processes them
-                
-                # Format Property column: Red if "Required"
-                if property_col:
-                    for row_num in range(2, data_rows + 1):  # Skip header row
-                        cell = worksheet[f'{property_col}{row_num}']
-                        # The cell contains a formula =IF(H2<>0,"Required","")
-                        # We need to use Excel's conditional formatting for this
-                
-                # Use Excel's built-in conditional formatting instead of cell-by-cell formatting
-                from openpyxl.formatting.rule import CellIsRule, FormulaRule
-                
-                # Conditional formatting for Allocation_Status: Red if not "Balanced"
-                if allocation_status_col:
-                    rule = CellIsRule(operator='notEqual', formula=['"Balanced"'], fill=red_fill, font=red_font)
-                    worksheet.conditional_formatting.add(f'{allocation_status_col}2:{allocation_status_col}{data_rows}', rule)
+                st.download_button(
+                    label="📄 Download Allocated Excel File",
+                    data=partial(build_excel_file, processed_df, amount_column, processed_key),
+                    file_name=f"{base_name}_allocated.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    width="stretch"
+                )
+                st.caption("✅ Native Excel file with currency formatting, fixed-width columns, wrapped headers, conditional formatting, formulas, and totals")
+            else:
+                # Plain values - much faster to produce for large statements
+                st.write(f"**📊 Allocation Values ({download_format}, no formulas):**")
                 
-                # Conditional formatting for Property: Red if "Required"
-                if property_col:
-                    rule = CellIsRule(operator='equal', formula=['"Required"'], fill=red_fill, font=red_font)
-                    worksheet.conditional_formatting.add(f'{property_col}2:{property_col}{data_rows}', rule)
-            
-            output.seek(0)
-            
-            st.download_button(
-                label="📄 Download Allocated Excel File",
-                data=output.getvalue(),
-                file_name=enhanced_filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
-            )
-            st.caption("✅ Native Excel file with currency formatting, fixed-width columns, wrapped headers, conditional formatting, formulas, and totals")
+                st.download_button(
+                    label=f"📄 Download Allocated {download_format} File",
+                    data=partial(build_flat_file, processed_df, download_format, processed_key),
+                    file_name=f"{base_name}_allocated.{'parquet' if download_format == 'Parquet' else 'csv'}",
+                    mime="application/vnd.apache.parquet" if download_format == "Parquet" else "text/csv",
+                    width="stretch"
+                )
+                st.caption("✅ Every column as computed, without formulas or the totals row - use Excel to edit allocations")
             
             # Instructions for Excel usage
             with st.expander("📖 Excel Formula Features"):
@@ -577,14 +766,14 @@ if uploaded_file is not None:
         st.write(f"- File name: {uploaded_file.name}")
         st.write(f"- File size: {uploaded_file.size} bytes")
         
-        # Try to show column info
-        try:
-            df_debug = pd.read_csv(uploaded_file)
-            st.write(f"- Columns found: {list(df_debug.columns)}")
-            st.write(f"- Data types: {dict(df_debug.dtypes)}")
-            st.dataframe(df_debug.head(5))
-        except Exception as debug_error:
-            st.write(f"- Could not read file for debugging: {debug_error}")
+        # Show column info from the frame already parsed - if parsing itself failed,
+        # the error above is the parser's and re-reading would only repeat it
+        if df is None:
+            st.write("- Could not read file for debugging: the CSV could not be parsed")
+        else:
+            st.write(f"- Columns found: {list(df.columns)}")
+            st.write(f"- Data types: {dict(df.dtypes)}")
+            st.dataframe(df.head(5))
 
 else:
     st.info("👆 Upload your credit card statement CSV to begin allocation")
@@ -0,0 +1,84 @@
+import io
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402  (runs the page script in bare mode; no file is uploaded)
+
+
+def test_reupload_keeps_entity_columns_in_place():
+    """A re-uploaded export already has the entity and check columns; they stay at F..O"""
+    header = ["Status", "Date", "Description", "Debit", "Credit", *app.ENTITIES,
+              "Total_Allocated", "Allocation_Check", "Allocation_Status", "Property"]
+    rows = [
+        ["Cleared", "2024-01-01", "Merchant 1", "10.5", "", "10.5", "0", "0", "0", "0", "0", "10.5", "0", "Balanced", ""],
+        ["Cleared", "2024-01-02", "Merchant 2", "", "-4.25", "-4.25", "0", "0", "0", "0", "0", "-4.25", "0", "Balanced", ""],
+    ]
+    csv_bytes = "\n".join(",".join(f'"{v}"' for v in row) for row in [header, *rows]).encode()
+
+    df = app.load_csv(csv_bytes)
+    processed_df, metrics = app.process_credit_card_data(df, "Debit", "reupload")
+
+    assert processed_df.columns.tolist() == header
+    assert processed_df["Panola Holdings LLC"].tolist() == [10.5, -4.25]
+    assert metrics["entity_totals"]["Panola Holdings LLC"] == 6.25
+
+    formula_columns, totals_row = app.create_excel_with_formulas(processed_df, "Debit")
+    assert formula_columns["Total_Allocated"][0] == "=SUM(F2:K2)"
+    assert formula_columns["Allocation_Check"][0] == "=(D2+E2)-L2"
+    assert formula_columns["Property"][0] == '=IF(H2<>0,"Required","")'
+    assert totals_row["Total_Allocated"] == "=SUM(L2:L3)"
+
+
+def test_load_csv_reads_pandas_na_strings_as_missing():
+    """"None" and "<NA>" are missing values for pandas' parser, so they are for load_csv too"""
+    csv_bytes = b"Status,Date,Description,Debit,Credit,\nCleared,2024-01-01,None,None,1.5,\n<NA>,2024-01-02,Shop,2.5,,\n"
+
+    df = app.load_csv(csv_bytes)
+
+    # A trailing comma on the header names the blank column as pandas would
+    assert df.columns.tolist() == ["Status", "Date", "Description", "Debit", "Credit", "Unnamed: 5"]
+
+    assert df["Description"].isna().tolist() == [True, False]
+    assert df["Status"].isna().tolist() == [False, True]
+    assert df["Debit"].dtype == "float64"
+    assert df["Debit"].isna().tolist() == [True, False]
+
+
+def test_load_csv_rejects_non_utf8_text():
+    """A latin-1 upload fails with pandas' decode error instead of showing bytes"""
+    csv_bytes = "Status,Date,Description,Debit,Credit\nCleared,2024-01-01,café,1.5,0\n".encode("latin-1")
+
+    with pytest.raises(UnicodeDecodeError):
+        app.load_csv(csv_bytes)
+
+
+def test_parquet_export_writes_mixed_type_columns_as_text():
+    """The pandas fallback can leave ints and strs in one column; Parquet stores them as text"""
+    df = pd.DataFrame({"Ref": [393215, "393216"], "Debit": [1.0, 2.0]})
+
+    parquet_bytes = app.build_flat_file(df, "Parquet", "mixed-ref")
+
+    exported = pd.read_parquet(io.BytesIO(parquet_bytes))
+    assert exported["Ref"].tolist() == ["393215", "393216"]
+    assert exported["Debit"].tolist() == [1.0, 2.0]
+
+
+def test_process_cache_is_keyed_on_the_upload():
+    """An edit outside Streamlit's 10k-row hash sample still reprocesses the statement"""
+    header = b"Status,Date,Description,Debit,Credit\n"
+    rows = [b"Cleared,2024-01-01,Shop,1.0,0\n"] * 60_000
+    original = header + b"".join(rows)
+    rows[-1] = b"Cleared,2024-01-01,Shop,999999.0,0\n"
+    edited = header + b"".join(rows)
+
+    first, _ = app.process_credit_card_data(app.load_csv(original), "Debit", "original")
+    second, metrics = app.process_credit_card_data(app.load_csv(edited), "Debit", "edited")
+
+    assert first["Panola Holdings LLC"].iloc[-1] == 1.0
+    assert second["Panola Holdings LLC"].iloc[-1] == 999999.0
+    assert metrics["entity_totals"]["Panola Holdings LLC"] == 59_999.0 + 999999.0